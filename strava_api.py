@@ -1,12 +1,72 @@
+import asyncio
+import threading
+import time
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
 import json
-from datetime import datetime
+import os
+import orjson
+from datetime import datetime, timedelta
 import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import urllib.parse
 
+TOKEN_URL = "https://www.strava.com/oauth/token"
+TOKEN_CACHE = os.path.expanduser('~/.strava_token.json')
+
+class _TokenBucket:
+    """
+    Adaptive token bucket pacing requests from this client.
+    The refill rate grows by `alpha` tokens/s after each success (up to `sigma`)
+    and is multiplied by `beta` after a 429/5xx (down to `delta`).
+    """
+    def __init__(self, capacity, rate, sigma=10.0, delta=0.1, alpha=0.1, beta=0.5):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.rate = rate
+        self.last_refill = time.monotonic()
+        self.sigma = sigma
+        self.delta = delta
+        self.alpha = alpha
+        self.beta = beta
+        # Pages are fetched from worker threads, so guard the shared state
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _take(self):
+        """Take a token if one is available, otherwise return the seconds to wait"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def increase_rate(self):
+        with self._lock:
+            self.rate = min(self.sigma, self.rate + self.alpha)
+
+    def decrease_rate(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.delta, self.rate * self.beta)
+            self.tokens = 0
+
 class StravaAPI:
-    def __init__(self, access_token=None):
+    def __init__(self, access_token=None, cache_name='strava_cache.sqlite'):
         self.access_token = access_token
         self.base_url = "https://www.strava.com/api/v3"
         self.headers = {}
@@ -14,71 +74,233 @@ class StravaAPI:
             self.headers = {
                 'Authorization': f'Bearer {self.access_token}'
             }
+        # Reuse one pooled connection to the API host across calls, and cache
+        # responses on disk since past activities don't change
+        self._session = requests_cache.CachedSession(
+            cache_name,
+            expire_after=timedelta(hours=36),
+            allowable_methods=('GET',)
+        )
+        self._session.headers.update(self.headers)
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        # Rate limit headers from the most recent response
+        self.last_limit_headers = {}
+        # Serializes the rate limit pacing across the page worker threads
+        self._pace_lock = threading.Lock()
+        self._bucket = _TokenBucket(capacity=100, rate=1.0)
+
+    def _record_rate_limit(self, response):
+        """Remember Strava's rate limit headers from a response"""
+        for header in ('X-RateLimit-Limit', 'X-RateLimit-Usage'):
+            if header in response.headers:
+                self.last_limit_headers[header] = response.headers[header]
+
+    def _retry_after(self, response):
+        """Seconds to wait after a 429 response"""
+        try:
+            return max(0, int(response.headers.get('Retry-After', 60)))
+        except ValueError:
+            return 60
+
+    def rate_limit_delay(self):
+        """
+        Seconds to wait before the next request to stay under the 15-minute limit.
+        Only paces requests once fewer than 10 remain in the current window.
+        """
+        limit = self.last_limit_headers.get('X-RateLimit-Limit')
+        usage = self.last_limit_headers.get('X-RateLimit-Usage')
+        if not limit or not usage:
+            return 0
+        try:
+            short_limit = int(limit.split(',')[0])
+            short_used = int(usage.split(',')[0])
+        except ValueError:
+            return 0
+        remaining_short = short_limit - short_used
+        if remaining_short >= 10:
+            return 0
+        return 15 * 60 / max(remaining_short, 1)
+
+    def _update_bucket(self, response):
+        """Adapt the client request rate to the response status"""
+        if response.status_code == 429 or response.status_code >= 500:
+            self._bucket.decrease_rate()
+        elif response.status_code < 300:
+            self._bucket.increase_rate()
+
+    def _get(self, endpoint, params=None, force_refresh=False, max_retries=3):
+        """
+        GET an endpoint, waiting out up to `max_retries` 429 responses.
+        Raises requests.HTTPError if Strava still rate limits after that
+        (e.g. once the daily quota is used up).
+        """
+        if not force_refresh:
+            # Serve from the cache when possible without spending rate limit
+            response = self._session.get(endpoint, params=params, only_if_cached=True)
+            if response.status_code != 504:
+                return response
+        for attempt in range(max_retries + 1):
+            # Only slow down when Strava reports we're close to the limit
+            with self._pace_lock:
+                time.sleep(self.rate_limit_delay())
+            self._bucket.acquire()
+            response = self._session.get(endpoint, params=params, force_refresh=force_refresh)
+            self._record_rate_limit(response)
+            self._update_bucket(response)
+            if response.status_code != 429:
+                return response
+            if attempt < max_retries:
+                time.sleep(self._retry_after(response))
+        response.raise_for_status()
 
     def get_athlete(self):
         """Get the authenticated athlete's profile"""
         endpoint = f"{self.base_url}/athlete"
-        response = requests.get(endpoint, headers=self.headers)
-        return response.json()
+        response = self._get(endpoint)
+        response.raise_for_status()
+        return orjson.loads(response.content)
 
-    def get_activities(self, per_page=30, page=1):
-        """Get the authenticated athlete's activities"""
+    def get_activities(self, per_page=30, page=1, force_refresh=False, after=None, before=None):
+        """
+        Get the authenticated athlete's activities.
+        after/before are Unix timestamps limiting the activities returned.
+        Set force_refresh to bypass the response cache (e.g. for the latest page).
+        """
         endpoint = f"{self.base_url}/athlete/activities"
         params = {
             'per_page': per_page,
             'page': page
         }
-        response = requests.get(endpoint, headers=self.headers, params=params)
-        return response.json()
+        if after is not None:
+            params['after'] = after
+        if before is not None:
+            params['before'] = before
+        response = self._get(endpoint, params=params, force_refresh=force_refresh)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    async def get_activities_async(self, per_page, page, force_refresh=False, after=None, before=None):
+        """Get a page of the authenticated athlete's activities without blocking the event loop"""
+        return await asyncio.to_thread(self.get_activities, per_page, page,
+                                       force_refresh=force_refresh, after=after, before=before)
 
     def get_activity(self, activity_id):
         """Get a specific activity by ID"""
         endpoint = f"{self.base_url}/activities/{activity_id}"
-        response = requests.get(endpoint, headers=self.headers)
-        return response.json()
+        response = self._get(endpoint)
+        response.raise_for_status()
+        return orjson.loads(response.content)
 
 class OAuthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        # Browsers may ask for a favicon before (or instead of) the callback
+        if url.path == '/favicon.ico':
+            self.send_response(404)
+            self.end_headers()
+            return
+        
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
         self.end_headers()
         
         # Parse the query parameters
-        query = urllib.parse.urlparse(self.path).query
-        params = urllib.parse.parse_qs(query)
+        params = urllib.parse.parse_qs(url.query)
         
         if 'code' in params:
             code = params['code'][0]
             self.server.auth_code = code
             self.wfile.write(b"Authentication successful! You can close this window.")
+            self.server.auth_done.set()
         else:
             self.wfile.write(b"Authentication failed. Please try again.")
+            if 'error' in params:
+                # The user denied access, there's no code coming
+                self.server.auth_done.set()
 
-def get_access_token(client_id, client_secret):
+def get_access_token(client_id, client_secret, timeout=120):
     # Start a local server to receive the OAuth callback
-    server = HTTPServer(('localhost', 8000), OAuthHandler)
+    server = ThreadingHTTPServer(('localhost', 8000), OAuthHandler)
     server.auth_code = None
+    server.auth_done = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
     
     # Open the authorization URL in the default browser
     auth_url = f"http://www.strava.com/oauth/authorize?client_id={client_id}&response_type=code&redirect_uri=http://localhost:8000&approval_prompt=force&scope=activity:read_all"
     webbrowser.open(auth_url)
     
     # Wait for the authorization code
-    server.handle_request()
+    server.auth_done.wait(timeout=timeout)
+    server.shutdown()
+    server.server_close()
     
     if server.auth_code:
         # Exchange the authorization code for an access token
-        token_url = "https://www.strava.com/oauth/token"
         data = {
             'client_id': client_id,
             'client_secret': client_secret,
             'code': server.auth_code,
             'grant_type': 'authorization_code'
         }
-        response = requests.post(token_url, data=data)
-        return response.json()
+        with requests.Session() as session:
+            response = session.post(TOKEN_URL, data=data)
+        return orjson.loads(response.content)
     return None
 
+def refresh_access_token(client_id, client_secret, refresh_token):
+    """Exchange a refresh token for a new access token"""
+    data = {
+        'client_id': client_id,
+        'client_secret': client_secret,
+        'refresh_token': refresh_token,
+        'grant_type': 'refresh_token'
+    }
+    with requests.Session() as session:
+        response = session.post(TOKEN_URL, data=data)
+    if not response.ok:
+        return None
+    return orjson.loads(response.content)
+
+def load_token(path=TOKEN_CACHE):
+    """Load token data saved by save_token, or None if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+
+def save_token(token_data, path=TOKEN_CACHE):
+    """Save token data to a file only readable by the current user"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(orjson.dumps(token_data))
+    os.chmod(path, 0o600)
+
+def get_cached_access_token(client_id, client_secret, path=TOKEN_CACHE):
+    """
+    Get token data, reusing the cached access token while it's valid and
+    refreshing it when expired. Only falls back to the browser OAuth flow
+    when there is no cached token or the refresh fails.
+    """
+    token_data = load_token(path)
+    if token_data:
+        if token_data.get('expires_at', 0) > time.time() + 60:
+            return token_data
+        if 'refresh_token' in token_data:
+            try:
+                refreshed = refresh_access_token(client_id, client_secret, token_data['refresh_token'])
+            except requests.RequestException:
+                # Treat network errors like a rejected refresh
+                refreshed = None
+            if refreshed and 'access_token' in refreshed:
+                save_token(refreshed, path)
+                return refreshed
+    
+    token_data = get_access_token(client_id, client_secret)
+    if token_data and 'access_token' in token_data:
+        save_token(token_data, path)
+    return token_data
+
 # Example usage:
 if __name__ == "__main__":
     # Replace these with your actual client ID and secret
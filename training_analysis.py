@@ -1,48 +1,163 @@
+import asyncio
+import configparser
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
-from strava_api import StravaAPI, get_access_token
+from strava_api import StravaAPI, get_cached_access_token
 import json
 import time
 from pytz import UTC
 import os
+from functools import lru_cache
 
+# Activities already downloaded from Strava, keyed by activity id
+ACTIVITIES_STORE = 'activities.parquet'
+# (after, before) Unix timestamp intervals already fully downloaded into the store
+ACTIVITIES_COVERAGE = 'activities_coverage.json'
+# Activities can be uploaded a while after they started, so the most recent
+# part of a fetched window isn't considered covered yet
+COVERAGE_SETTLE_SECONDS = 2 * 24 * 60 * 60
+STORED_COLUMNS = ['id', 'start_date', 'distance', 'moving_time', 'total_elevation_gain']
+# Strava's UTC timestamp format
+STRAVA_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+ACTIVITY_DTYPES = {
+    'id': 'int64',
+    'distance': 'float32',
+    'moving_time': 'int32',
+    'total_elevation_gain': 'float32'
+}
+
+@lru_cache(maxsize=1)
 def get_credentials(file_path='strava_id.txt'):
     """
     Read Strava API credentials from a file
     Returns: tuple of (client_id, client_secret)
+    Raises FileNotFoundError if the file is missing, KeyError if a credential is
+    missing and configparser.Error if the file can't be parsed
     """
-    try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-            credentials = {}
-            for line in lines:
-                if '=' in line:
-                    key, value = line.strip().split('=')
-                    credentials[key.strip()] = value.strip()
-            
-            if 'client_id' not in credentials or 'client_secret' not in credentials:
-                raise ValueError("Missing required credentials in file")
-            
-            return credentials['client_id'], credentials['client_secret']
-    except FileNotFoundError:
-        print(f"Error: Credentials file '{file_path}' not found.")
-        print("Please create a file named 'strava_id.txt' with your credentials in the format:")
-        print("client_id = your_client_id")
-        print("client_secret = your_client_secret")
-        exit(1)
-    except Exception as e:
-        print(f"Error reading credentials: {str(e)}")
-        exit(1)
+    # strict=False keeps the last value of a repeated key
+    parser = configparser.ConfigParser(delimiters=('=',), interpolation=None, strict=False)
+    with open(file_path, 'r') as f:
+        # Only key = value lines matter, anything else is ignored as before.
+        # Lines are stripped so indentation isn't read as a value continuation.
+        lines = [line.strip() + '\n' for line in f
+                 if '=' in line and line.split('=', 1)[0].strip()]
+    # The file has no section header, so parse it under a synthetic one
+    parser.read_string('[strava]\n' + ''.join(lines))
+    
+    credentials = parser['strava']
+    for key in ('client_id', 'client_secret'):
+        if key not in credentials:
+            raise KeyError(f"Missing '{key}' in credentials file '{file_path}'")
+    return credentials['client_id'], credentials['client_secret']
+
+def _append_activities(columns, activities):
+    """Append the fields we use from a page of activities to per-column lists"""
+    for a in activities:
+        columns['id'].append(a['id'])
+        columns['start_date'].append(a['start_date'])
+        columns['distance'].append(a.get('distance', 0.0))
+        columns['moving_time'].append(a.get('moving_time', 0))
+        columns['total_elevation_gain'].append(a.get('total_elevation_gain', 0.0))
+
+def load_stored_activities(path=ACTIVITIES_STORE):
+    """Load previously downloaded activities, or None if there are none"""
+    if not os.path.exists(path):
+        return None
+    stored = pd.read_parquet(path)
+    if len(stored) == 0:
+        return None
+    return stored
+
+def load_coverage(path=ACTIVITIES_COVERAGE):
+    """Load the intervals already downloaded into the store"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [tuple(interval) for interval in json.load(f)]
+
+def save_coverage(coverage, path=ACTIVITIES_COVERAGE):
+    with open(path, 'w') as f:
+        json.dump([list(interval) for interval in coverage], f)
+
+def _merge_intervals(intervals):
+    """Sort intervals and merge the overlapping or touching ones"""
+    merged = []
+    for after, before in sorted(intervals):
+        if merged and after <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], before))
+        else:
+            merged.append((after, before))
+    return merged
+
+def _fetch_ranges(coverage, after, before):
+    """
+    Split the (after, before) Unix timestamp window into the ranges that
+    aren't covered yet. A None bound means the window is open on that side.
+    """
+    start = after or 0
+    end = float('inf') if before is None else before
+    ranges = []
+    for covered_after, covered_before in _merge_intervals(coverage):
+        if covered_before <= start:
+            continue
+        if covered_after >= end:
+            break
+        if covered_after > start:
+            ranges.append((start, covered_after))
+        start = covered_before
+    if start < end:
+        ranges.append((start, before))
+    return ranges
+
+async def fetch_activities(strava_api, after=None, before=None, per_page=100, concurrency=5):
+    """
+    Fetch activities page by page, requesting up to `concurrency` pages at once.
+    Waves of pages start at one and double, so short windows don't request
+    pages past the end.
+    after/before are Unix timestamps so Strava filters the date range server-side.
+    Returns a dict of per-column lists keyed by STORED_COLUMNS.
+    """
+    columns = {col: [] for col in STORED_COLUMNS}
+    # Without `after` Strava lists newest first, so a new activity shifts every
+    # page; if `before` is missing or still in the future, new activities land
+    # on the last page. Only pages of a window closed in the past are stable
+    # enough to serve from the cache.
+    force_refresh = after is None or before is None or before > time.time()
+    print("Fetching page 1...", end='\r')
+    activities = strava_api.get_activities(per_page=per_page, page=1, force_refresh=force_refresh,
+                                           after=after, before=before)
+    _append_activities(columns, activities)
+    # A short page means there are no more activities
+    if len(activities) < per_page:
+        return columns
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_page(page):
+        async with semaphore:
+            return await strava_api.get_activities_async(per_page, page, force_refresh=force_refresh,
+                                                         after=after, before=before)
+
+    page = 2
+    wave = 1
+    while True:
+        print(f"Fetching pages {page}-{page + wave - 1}...", end='\r')
+        pages = await asyncio.gather(*[fetch_page(p) for p in range(page, page + wave)])
+        # Stop at the first short page
+        for activities in pages:
+            _append_activities(columns, activities)
+            if len(activities) < per_page:
+                return columns
+        page += wave
+        wave = min(wave * 2, concurrency)
 
 def analyze_training_data(strava_api, start_date=None, end_date=None):
     """
     Analyze training data and create insights for next season planning
     """
     print("Fetching activities from Strava...")
-    # Get all activities
-    all_activities = []
-    page = 1
     
     # Convert dates to UTC if provided
     if start_date:
@@ -50,59 +165,56 @@ def analyze_training_data(strava_api, start_date=None, end_date=None):
     if end_date:
         end_date = pd.to_datetime(end_date).tz_localize(UTC)
     
-    while True:
-        print(f"Fetching page {page}...", end='\r')
-        try:
-            activities = strava_api.get_activities(per_page=100, page=page)
-            
-            if not activities:  # If no activities returned
-                print("\nNo more activities found")
-                break
-                
-            # Check if we've reached activities before our start date
-            if start_date and activities:  # Only proceed if we have activities
-                last_activity = activities[-1]  # Get the last activity
-                if 'start_date' in last_activity:  # Check if start_date exists
-                    last_activity_date = pd.to_datetime(last_activity['start_date'])
-                    if last_activity_date < start_date:
-                        # Only keep activities within our date range
-                        filtered_activities = [a for a in activities 
-                                            if 'start_date' in a and 
-                                            pd.to_datetime(a['start_date']) >= start_date]
-                        if filtered_activities:  # Only extend if we have activities in our date range
-                            all_activities.extend(filtered_activities)
-                        break
-                
-            all_activities.extend(activities)
-            page += 1
-            
-            # Add a small delay to avoid rate limiting
-            time.sleep(1)
-            
-        except Exception as e:
-            print(f"\nError fetching activities: {str(e)}")
-            break
+    # Only fetch the parts of the date range that weren't downloaded before
+    stored = load_stored_activities()
+    coverage = []
+    if stored is not None:
+        coverage = load_coverage()
+        print(f"Loaded {len(stored)} stored activities")
+    after = int(start_date.timestamp()) if start_date else None
+    before = int(end_date.timestamp()) if end_date else None
+    settled = int(time.time()) - COVERAGE_SETTLE_SECONDS
+    
+    # Get all activities (stored ones are trimmed to the date range below)
+    columns = {col: [] for col in STORED_COLUMNS}
+    try:
+        for range_after, range_before in _fetch_ranges(coverage, after, before):
+            fetched_columns = asyncio.run(fetch_activities(strava_api, range_after, range_before))
+            for col in STORED_COLUMNS:
+                columns[col].extend(fetched_columns[col])
+            covered_before = settled if range_before is None else min(range_before, settled)
+            if range_after < covered_before:
+                coverage.append((range_after, covered_before))
+    except Exception as e:
+        print(f"\nError fetching activities: {str(e)}")
+    fetched = len(columns['id'])
     
-    print(f"\nFetched {len(all_activities)} activities")
+    print(f"\nFetched {fetched} activities")
     
-    if not all_activities:
+    if not fetched and stored is None:
         print("No activities found in the specified date range")
         return None, None
 
     # Convert to DataFrame
     print("Processing data...")
     try:
-        df = pd.DataFrame(all_activities)
-        
-        # Check if we have the required columns
-        required_columns = ['start_date', 'distance', 'moving_time', 'total_elevation_gain']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            print(f"Missing required columns: {missing_columns}")
-            return None, None
+        frames = [stored] if stored is not None else []
+        if fetched:
+            new = pd.DataFrame({
+                'id': np.asarray(columns['id'], dtype=ACTIVITY_DTYPES['id']),
+                # Date strings are already UTC from Strava
+                'start_date': pd.to_datetime(columns['start_date'], format=STRAVA_DATE_FORMAT, utc=True),
+                'distance': np.asarray(columns['distance'], dtype=ACTIVITY_DTYPES['distance']),
+                'moving_time': np.asarray(columns['moving_time'], dtype=ACTIVITY_DTYPES['moving_time']),
+                'total_elevation_gain': np.asarray(columns['total_elevation_gain'],
+                                                   dtype=ACTIVITY_DTYPES['total_elevation_gain'])
+            })
+            frames.append(new)
         
-        # Convert date strings to datetime (they're already UTC from Strava)
-        df['start_date'] = pd.to_datetime(df['start_date'])
+        # Merge with the stored activities and save for the next run
+        df = pd.concat(frames, ignore_index=True).drop_duplicates(subset='id', keep='last')
+        df.to_parquet(ACTIVITIES_STORE, index=False)
+        save_coverage(_merge_intervals(coverage))
         
         # Filter by date range if provided
         if start_date:
@@ -114,22 +226,26 @@ def analyze_training_data(strava_api, start_date=None, end_date=None):
             print("No activities found after filtering by date range")
             return None, None
         
-        # Calculate additional metrics
-        df['week'] = df['start_date'].dt.isocalendar().week
-        df['month'] = df['start_date'].dt.month
-        df['year'] = df['start_date'].dt.year
-        
-        # Group by week and calculate metrics
+        # Group by ISO week (Monday to Sunday) and calculate metrics
         print("Calculating weekly statistics...")
-        weekly_stats = df.groupby(['year', 'week']).agg({
-            'distance': 'sum',
-            'moving_time': 'sum',
-            'total_elevation_gain': 'sum',
-            'id': 'count'
-        }).reset_index()
+        df = df.set_index('start_date').sort_index()
+        # float32 is only for storage: aggregate in float64, rounded back to the
+        # 0.1 m precision Strava reports, so no float32 noise reaches the outputs
+        for col in ('distance', 'total_elevation_gain'):
+            df[col] = df[col].astype('float64').round(1)
+        weekly_stats = df.resample('W-SUN').agg(
+            total_distance_km=('distance', 'sum'),
+            total_time_minutes=('moving_time', 'sum'),
+            total_elevation_meters=('total_elevation_gain', 'sum'),
+            number_of_activities=('id', 'count')
+        )
+        # Only keep weeks with activities
+        weekly_stats = weekly_stats[weekly_stats['number_of_activities'] > 0]
         
-        weekly_stats.columns = ['year', 'week', 'total_distance_km', 'total_time_minutes', 
-                              'total_elevation_meters', 'number_of_activities']
+        iso = weekly_stats.index.isocalendar()
+        weekly_stats.insert(0, 'year', iso['year'])
+        weekly_stats.insert(1, 'week', iso['week'])
+        weekly_stats = weekly_stats.reset_index(drop=True)
         
         # Convert units
         weekly_stats['total_distance_km'] = weekly_stats['total_distance_km'] / 1000
@@ -138,19 +254,20 @@ def analyze_training_data(strava_api, start_date=None, end_date=None):
         # Calculate intensity (distance/time)
         weekly_stats['average_speed_kmh'] = weekly_stats['total_distance_km'] / weekly_stats['total_time_hours']
         
-        # Save to CSV
+        # Save as Parquet for reuse and as compressed CSV for reading
         print("Saving results...")
-        weekly_stats.to_csv('training_analysis.csv', index=False)
+        weekly_stats.to_parquet('training_analysis.parquet', index=False, compression='zstd')
+        weekly_stats.to_csv('training_analysis.csv.gz', index=False, compression='gzip')
         
         # Generate summary statistics
         summary = {
             'total_weeks': len(weekly_stats),
-            'average_weekly_distance': weekly_stats['total_distance_km'].mean(),
-            'max_weekly_distance': weekly_stats['total_distance_km'].max(),
-            'average_weekly_time': weekly_stats['total_time_hours'].mean(),
-            'average_weekly_activities': weekly_stats['number_of_activities'].mean(),
-            'total_elevation': weekly_stats['total_elevation_meters'].sum(),
-            'average_speed': weekly_stats['average_speed_kmh'].mean()
+            'average_weekly_distance': float(weekly_stats['total_distance_km'].mean()),
+            'max_weekly_distance': float(weekly_stats['total_distance_km'].max()),
+            'average_weekly_time': float(weekly_stats['total_time_hours'].mean()),
+            'average_weekly_activities': float(weekly_stats['number_of_activities'].mean()),
+            'total_elevation': float(weekly_stats['total_elevation_meters'].sum()),
+            'average_speed': float(weekly_stats['average_speed_kmh'].mean())
         }
         
         # Save summary to JSON
@@ -168,45 +285,33 @@ def plot_training_data(weekly_stats):
     Create visualization of training data
     """
     print("Creating visualizations...")
-    plt.figure(figsize=(15, 10))
+    fig, axes = plt.subplots(2, 2, figsize=(15, 10), sharex=True)
     
     # Create a proper x-axis label combining year and week
-    x_labels = [f"{row['year']}-W{row['week']}" for _, row in weekly_stats.iterrows()]
-    
-    # Plot 1: Weekly Distance
-    plt.subplot(2, 2, 1)
-    plt.bar(x_labels, weekly_stats['total_distance_km'], color='skyblue')
-    plt.title('Weekly Distance (km)')
-    plt.xlabel('Week')
-    plt.ylabel('Distance (km)')
-    plt.xticks(rotation=45)
-    
-    # Plot 2: Weekly Time
-    plt.subplot(2, 2, 2)
-    plt.bar(x_labels, weekly_stats['total_time_hours'], color='lightgreen')
-    plt.title('Weekly Training Time (hours)')
-    plt.xlabel('Week')
-    plt.ylabel('Time (hours)')
-    plt.xticks(rotation=45)
+    x_labels = (weekly_stats['year'].astype(str) + '-W' + weekly_stats['week'].astype(str)).tolist()
+    positions = list(range(len(x_labels)))
     
-    # Plot 3: Number of Activities
-    plt.subplot(2, 2, 3)
-    plt.bar(x_labels, weekly_stats['number_of_activities'], color='salmon')
-    plt.title('Number of Activities per Week')
-    plt.xlabel('Week')
-    plt.ylabel('Number of Activities')
-    plt.xticks(rotation=45)
+    plots = [
+        (axes[0, 0], 'total_distance_km', 'skyblue', 'Weekly Distance (km)', 'Distance (km)'),
+        (axes[0, 1], 'total_time_hours', 'lightgreen', 'Weekly Training Time (hours)', 'Time (hours)'),
+        (axes[1, 0], 'number_of_activities', 'salmon', 'Number of Activities per Week', 'Number of Activities'),
+        (axes[1, 1], 'average_speed_kmh', 'gold', 'Average Speed (km/h)', 'Speed (km/h)'),
+    ]
+    for ax, column, color, title, ylabel in plots:
+        ax.bar(positions, weekly_stats[column], color=color)
+        ax.set_title(title)
+        ax.set_ylabel(ylabel)
     
-    # Plot 4: Average Speed
-    plt.subplot(2, 2, 4)
-    plt.bar(x_labels, weekly_stats['average_speed_kmh'], color='gold')
-    plt.title('Average Speed (km/h)')
-    plt.xlabel('Week')
-    plt.ylabel('Speed (km/h)')
-    plt.xticks(rotation=45)
+    # The x-axis is shared, so label it once and keep at most ~40 ticks
+    step = max(1, -(-len(x_labels) // 40))
+    axes[1, 0].set_xticks(positions[::step])
+    axes[1, 0].set_xticklabels(x_labels[::step])
+    for ax in axes[1]:
+        ax.set_xlabel('Week')
+    fig.autofmt_xdate(rotation=45)
     
-    plt.tight_layout()
-    plt.savefig('training_analysis.png')
+    fig.tight_layout()
+    fig.savefig('training_analysis.png')
 
 def get_date_input(prompt):
     while True:
@@ -222,11 +327,21 @@ if __name__ == "__main__":
     print("Starting training analysis...")
     
     # Get credentials from file
-    client_id, client_secret = get_credentials()
+    try:
+        client_id, client_secret = get_credentials()
+    except FileNotFoundError:
+        print("Error: Credentials file 'strava_id.txt' not found.")
+        print("Please create a file named 'strava_id.txt' with your credentials in the format:")
+        print("client_id = your_client_id")
+        print("client_secret = your_client_secret")
+        exit(1)
+    except Exception as e:
+        print(f"Error reading credentials: {str(e)}")
+        exit(1)
     
     # Get access token using OAuth
     print("\nGetting access token...")
-    token_data = get_access_token(client_id, client_secret)
+    token_data = get_cached_access_token(client_id, client_secret)
     
     if token_data and 'access_token' in token_data:
         # Initialize Strava API with the new access token
@@ -261,7 +376,8 @@ if __name__ == "__main__":
             print(f"Average speed: {summary['average_speed']:.2f} km/h")
             
             print("\nData has been saved to:")
-            print("- training_analysis.csv (detailed weekly data)")
+            print("- training_analysis.csv.gz (detailed weekly data)")
+            print("- training_analysis.parquet (detailed weekly data, for reuse)")
             print("- training_summary.json (summary statistics)")
             print("- training_analysis.png (visualizations)")
         else: